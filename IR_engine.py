@@ -7,15 +7,22 @@ OPTIONS:
     -p : use "with stemming" configuration (default: without)
     -w LABEL : use weighting scheme "LABEL" (LABEL in {binary, tf, tfidf}, default: binary)
     -o FILE : output results to file FILE
+    -q FILE : stream preprocessed queries from FILE, one per line as
+              "QID TERM TERM ..." ("-" reads stdin; default: pickled queries)
+    -j N : process queries with N worker processes (default: 1)
 ------------------------------------------------------------\
 """
 
 #==============================================================================
 # Importing
 
+import os
 import sys
 import getopt
 import pickle
+import queue
+import itertools
+import multiprocessing
 
 from my_retriever import Retrieve
 
@@ -24,7 +31,7 @@ from my_retriever import Retrieve
 
 class CommandLine:
     def __init__(self):
-        opts, args = getopt.getopt(sys.argv[1:], 'hspw:o:')
+        opts, args = getopt.getopt(sys.argv[1:], 'hspw:o:q:j:')
         opts = dict(opts)
         self.exit = True
 
@@ -60,6 +67,27 @@ class CommandLine:
             self.print_help()
             return
 
+        self.query_file = opts.get('-q')
+        if self.query_file not in (None, '-') and \
+                not os.path.isfile(self.query_file):
+            print("*** ERROR: query file (opt: -q FILE) not found: %s ***"
+                  % (self.query_file), file=sys.stderr)
+            self.print_help()
+            return
+
+        if '-j' in opts:
+            try:
+                self.workers = int(opts['-j'])
+            except ValueError:
+                self.workers = 0
+            if self.workers < 1:
+                print("*** ERROR: worker count (opt: -j N) must be a "
+                      "positive integer ***", file=sys.stderr)
+                self.print_help()
+                return
+        else:
+            self.workers = 1
+
         if '-s' in opts:
             stoplist = 'yes'
         else:
@@ -76,9 +104,13 @@ class CommandLine:
         choice = 'index_stoplist_%s_stemming_%s' % (stoplist, stemming)
         self.index = all_data[choice]
             
-        choice = 'queries_stoplist_%s_stemming_%s' % (stoplist, stemming)
-        self.queries = all_data[choice]
-            
+        if self.query_file is None:
+            choice = 'queries_stoplist_%s_stemming_%s' % (stoplist, stemming)
+            self.queries = all_data[choice]
+        else:
+            self.queries = None
+        del all_data
+
         self.exit = False
 
     def print_help(self):
@@ -87,23 +119,131 @@ class CommandLine:
         help = __doc__.replace('<PROGNAME>', progname, 1)
         print(help, file=sys.stderr)
 
+#==============================================================================
+# Lazy query input
+
+def read_queries(query_file):
+    # Yields (qid, terms) one line at a time so that arbitrarily long query
+    # logs never have to be held in memory. Terms are expected to be
+    # preprocessed already (same stoplist/stemming as the chosen index).
+    if query_file == '-':
+        query_in = sys.stdin
+    else:
+        query_in = open(query_file, 'r')
+    try:
+        for line in query_in:
+            fields = line.split()
+            if not fields:
+                continue
+            qid = int(fields[0]) if fields[0].isdigit() else fields[0]
+            yield (qid, fields[1:])
+    finally:
+        if query_in is not sys.stdin:
+            query_in.close()
+
 #==============================================================================
 # Store for Retrieval Results
 
 class Result_Store:
-    def __init__(self):
-        self.results = []
+    # Writes results to the run file as soon as they are stored, rather than
+    # keeping them all until the end. Lines go through a buffered file and
+    # are flushed every `flush_every` queries, so a run that dies part way
+    # still leaves the completed queries on disk.
+    #
+    # When queries are processed concurrently results may arrive out of
+    # order; store_ranked() holds early arrivals back (keyed by position in
+    # the input) until every earlier query has been written. The run file is
+    # therefore always a clean prefix of the input, and a replay can resume
+    # from the last qid it contains.
+
+    def __init__(self, outfile, flush_every=100, buffer_size=1 << 16):
+        self.out = open(outfile, 'w', buffering=buffer_size)
+        self.flush_every = flush_every
+        self.unflushed = 0
+        self.pending = {}
+        self.next_seq = 0
 
     def store(self, qid, docids):
         if len(docids) > 10:
             docids = docids[:10]
-        self.results.append((qid, docids))
+        self.out.write(''.join('%s %s\n' % (qid, docid) for docid in docids))
+        self.unflushed += 1
+        if self.unflushed >= self.flush_every:
+            self.flush()
 
-    def output(self, outfile):
-        with open(outfile, 'w') as out:
-            for (qid, docids) in self.results:
-                for docid in docids:
-                    print(qid, docid, file=out)
+    def store_ranked(self, seq, qid, docids):
+        self.pending[seq] = (qid, docids)
+        while self.next_seq in self.pending:
+            self.store(*self.pending.pop(self.next_seq))
+            self.next_seq += 1
+
+    def flush(self):
+        self.out.flush()
+        self.unflushed = 0
+
+    def close(self):
+        # anything still pending sits behind a query that never finished
+        # (the run was cut short); writing it would leave a gap in the file
+        self.pending.clear()
+        self.out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+#==============================================================================
+# Parallel retrieval
+
+# Set in the parent before the pool is created so that forked workers
+# inherit the already built doc-term matrix instead of each rebuilding it.
+_worker_retrieve = None
+
+def _init_worker(index, term_weighting):
+    # only used where fork is unavailable (e.g. Windows)
+    global _worker_retrieve
+    _worker_retrieve = Retrieve(index, term_weighting)
+
+def _retrieve_numbered(seq, qid, query):
+    return (seq, qid, _worker_retrieve.for_query(query))
+
+def _make_pool(config):
+    global _worker_retrieve
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _worker_retrieve = Retrieve(config.index, config.term_weighting)
+        context = multiprocessing.get_context('fork')
+        return context.Pool(config.workers)
+    return multiprocessing.Pool(config.workers, _init_worker,
+                                (config.index, config.term_weighting))
+
+def run_parallel(config, queries, all_results):
+    # Sliding window over input positions: query `seq` is only submitted
+    # once seq < all_results.next_seq + window, i.e. once it is close enough
+    # to the next query due to be written. The pool keeps working while
+    # results come back, but queries in flight plus results waiting to be
+    # reassembled never exceed `window`, even behind one slow query.
+    window = config.workers * 64
+    numbered = enumerate(queries)
+    done = queue.Queue()
+    submitted = 0
+    in_flight = 0
+    with _make_pool(config) as pool:
+        while True:
+            limit = all_results.next_seq + window
+            for seq, (qid, query) in itertools.islice(numbered,
+                                                      limit - submitted):
+                pool.apply_async(_retrieve_numbered, (seq, qid, query),
+                                 callback=done.put, error_callback=done.put)
+                submitted += 1
+                in_flight += 1
+            if not in_flight:
+                break
+            item = done.get()
+            if isinstance(item, BaseException):
+                raise item
+            in_flight -= 1
+            all_results.store_ranked(*item)
 
 #==============================================================================
 # MAIN
@@ -113,13 +253,16 @@ if __name__ == '__main__':
     config = CommandLine()
     if config.exit:
         sys.exit(0)
-    queries = config.queries
-    retrieve = Retrieve(config.index, config.term_weighting)
-    all_results = Result_Store()
-
-    for (qid, query) in queries:
-        results = retrieve.for_query(query)
-        all_results.store(qid, results)
-
-    all_results.output(config.outfile)
+    if config.query_file is None:
+        queries = config.queries
+    else:
+        queries = read_queries(config.query_file)
 
+    with Result_Store(config.outfile) as all_results:
+        if config.workers > 1:
+            run_parallel(config, queries, all_results)
+        else:
+            retrieve = Retrieve(config.index, config.term_weighting)
+            for (qid, query) in queries:
+                results = retrieve.for_query(query)
+                all_results.store(qid, results)
@@ -0,0 +1,99 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME>
+Sanity checks for the streaming output in IR_engine.py:
+    - out-of-order store_ranked() calls are written in input order
+    - close() drops results behind a gap, leaving a clean prefix
+    - run_parallel() keeps in-flight + pending results within its
+      window when an early query is slow
+------------------------------------------------------------\
+"""
+
+#==============================================================================
+# Importing
+
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+
+import IR_engine
+
+#==============================================================================
+# Helpers
+
+def read_run(path):
+    with open(path, 'r') as run_in:
+        return run_in.read()
+
+def store_sequence(path, arrivals):
+    # arrivals: [(seq, qid, docids)] in the order the results come back
+    with IR_engine.Result_Store(path) as all_results:
+        for (seq, qid, docids) in arrivals:
+            all_results.store_ranked(seq, qid, docids)
+
+#==============================================================================
+# Checks
+
+def check_reorder(path):
+    store_sequence(path, [(2, 3, [30]), (0, 1, [10, 11]), (1, 2, [20])])
+    assert read_run(path) == '1 10\n1 11\n2 20\n3 30\n', read_run(path)
+
+def check_gap_dropped(path):
+    # seq 1 never arrives: 2 and 3 must not be written after 0
+    store_sequence(path, [(0, 1, [10]), (3, 4, [40]), (2, 3, [30])])
+    assert read_run(path) == '1 10\n', read_run(path)
+
+class Slow_First_Retrieve:
+    def __init__(self, index, term_weighting):
+        pass
+
+    def for_query(self, query):
+        if query == ['slow']:
+            time.sleep(1)
+        return [1]
+
+class Counting_Store(IR_engine.Result_Store):
+    def __init__(self, outfile):
+        IR_engine.Result_Store.__init__(self, outfile)
+        self.max_pending = 0
+
+    def store_ranked(self, seq, qid, docids):
+        IR_engine.Result_Store.store_ranked(self, seq, qid, docids)
+        self.max_pending = max(self.max_pending, len(self.pending))
+
+class Config:
+    workers = 2
+    index = None
+    term_weighting = 'binary'
+
+def check_bounded_pending(path):
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        print("skipped bounded pending check (needs fork)", file=sys.stderr)
+        return
+    num_queries = 5000
+    queries = [(1, ['slow'])] + [(qid, ['fast'])
+                                 for qid in range(2, num_queries + 1)]
+    saved_retrieve = IR_engine.Retrieve
+    IR_engine.Retrieve = Slow_First_Retrieve
+    try:
+        with Counting_Store(path) as all_results:
+            IR_engine.run_parallel(Config, queries, all_results)
+    finally:
+        IR_engine.Retrieve = saved_retrieve
+    window = Config.workers * 64
+    assert all_results.max_pending <= window, all_results.max_pending
+    expected = ''.join('%d 1\n' % qid for qid in range(1, num_queries + 1))
+    assert read_run(path) == expected
+
+#==============================================================================
+# MAIN
+
+if __name__ == '__main__':
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'run.txt')
+        for check in (check_reorder, check_gap_dropped, check_bounded_pending):
+            check(path)
+            print("ok", check.__name__)